@@ -1,11 +1,27 @@
 import asyncio
 import httpx
 import logging
-from typing import Dict, Any, Optional
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
 from models import OpenAIConfig, GeminiConfig, CohereConfig, GroqConfig, AnthropicConfig
 
 logger = logging.getLogger(__name__)
 
+class ProviderUnavailableError(Exception):
+    """Raised by providers when the upstream service is down, overloaded or rate limiting"""
+
+def is_provider_fault(error: BaseException) -> bool:
+    """Whether an error reflects provider health rather than the request itself (e.g. a bad API key)"""
+    if isinstance(error, (ProviderUnavailableError, asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    
+    return False
+
 class LLMProvider:
     """Base class for LLM providers"""
     
@@ -97,10 +113,160 @@ class AnthropicProvider(LLMProvider):
             logger.error(f"Anthropic API error: {str(e)}")
             raise
 
+class LatencyTracker:
+    """Rolling window of recent response latencies (in seconds)"""
+    
+    def __init__(self, window_size: int = 100):
+        self.samples = deque(maxlen=window_size)
+    
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+    
+    def percentile(self, pct: float) -> Optional[float]:
+        """Return the given percentile of recorded latencies, or None if there are no samples"""
+        if not self.samples:
+            return None
+        
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+        return ordered[index]
+
+class CircuitBreaker:
+    """Stops routing to a provider whose error rate or latency has degraded
+
+    Latency tripping is off unless latency_threshold (seconds) is set.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(
+        self,
+        window_size: int = 20,
+        min_requests: int = 5,
+        error_rate_threshold: float = 0.5,
+        latency_threshold: Optional[float] = None,
+        latency_percentile: float = 90.0,
+        cooldown: float = 30.0
+    ):
+        self.window_size = window_size
+        self.min_requests = min_requests
+        self.error_rate_threshold = error_rate_threshold
+        self.latency_threshold = latency_threshold
+        self.latency_percentile = latency_percentile
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window_size)
+        self.latencies = LatencyTracker(window_size)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+    
+    def allow_request(self) -> bool:
+        """Whether a request may be sent; lets a single trial through once the cooldown has passed"""
+        if self.state == self.CLOSED:
+            return True
+        
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        
+        return False
+    
+    def release_trial(self) -> None:
+        """Give back a half-open trial that ended without an outcome, e.g. a cancelled hedge loser"""
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = False
+    
+    def record_success(self, latency: float) -> None:
+        self.outcomes.append(True)
+        self.latencies.record(latency)
+        
+        if self.state == self.HALF_OPEN:
+            if self.latency_threshold is not None and latency > self.latency_threshold:
+                self._trip()
+            else:
+                self._reset()
+            return
+        
+        self._evaluate()
+    
+    def record_failure(self, latency: Optional[float] = None) -> None:
+        self.outcomes.append(False)
+        if latency is not None:
+            self.latencies.record(latency)
+        
+        if self.state == self.HALF_OPEN:
+            self._trip()
+            return
+        
+        self._evaluate()
+    
+    def _evaluate(self) -> None:
+        if self.state != self.CLOSED or len(self.outcomes) < self.min_requests:
+            return
+        
+        error_rate = self.outcomes.count(False) / len(self.outcomes)
+        if error_rate >= self.error_rate_threshold:
+            self._trip()
+            return
+        
+        if self.latency_threshold is not None:
+            latency = self.latencies.percentile(self.latency_percentile)
+            if latency is not None and latency > self.latency_threshold:
+                self._trip()
+    
+    def _trip(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+    
+    def _reset(self) -> None:
+        self.state = self.CLOSED
+        self.outcomes.clear()
+        self.latencies = LatencyTracker(self.window_size)
+        self._trial_in_flight = False
+
+class HedgingPolicy:
+    """Sends a backup request when the primary is slower than its recent latency percentile"""
+    
+    def __init__(
+        self,
+        fallback_provider: Optional[str] = None,
+        fallback_model: Optional[str] = None,
+        fallback_api_key: Optional[str] = None,
+        percentile: float = 95.0,
+        min_samples: int = 10,
+        default_delay: float = 2.0,
+        min_delay: float = 0.05
+    ):
+        self.fallback_provider = fallback_provider
+        self.fallback_model = fallback_model
+        self.fallback_api_key = fallback_api_key
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+    
+    def hedge_delay(self, tracker: LatencyTracker) -> float:
+        """How long to wait for the primary before sending the backup request"""
+        if len(tracker.samples) < self.min_samples:
+            return self.default_delay
+        
+        return max(self.min_delay, tracker.percentile(self.percentile))
+
 class LLMManager:
     """Manages different LLM providers"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        hedging_policy: Optional[HedgingPolicy] = None,
+        circuit_breaker_config: Optional[Dict[str, Any]] = None
+    ):
         self.providers = {
             "openai": OpenAIProvider(),
             "gemini": GeminiProvider(),
@@ -108,15 +274,19 @@ class LLMManager:
             "groq": GroqProvider(),
             "anthropic": AnthropicProvider()
         }
+        self.hedging_policy = hedging_policy
+        self.circuit_breaker_config = circuit_breaker_config or {}
+        self.latency_trackers: Dict[Tuple[str, Optional[str]], LatencyTracker] = {}
+        self.circuit_breakers: Dict[Tuple[str, Optional[str]], CircuitBreaker] = {}
     
     async def generate_response(self, provider_name: str, prompt: str, config: Dict[str, Any]) -> str:
-        """Generate response using specified provider"""
+        """Generate response using specified provider, hedging to a fallback if one is configured"""
         
-        if provider_name not in self.providers:
-            available = ", ".join(self.providers.keys())
-            raise ValueError(f"Unknown provider '{provider_name}'. Available: {available}")
+        self._check_provider(provider_name)
         
-        provider = self.providers[provider_name]
+        # The fallback key is only ever handed to the fallback provider
+        config = dict(config)
+        fallback_api_key = config.pop("fallbackApiKey", None)
         
         # Add system prompt if provided
         system_prompt = config.get("systemPrompt")
@@ -125,7 +295,173 @@ class LLMManager:
         else:
             full_prompt = prompt
         
-        return await provider.generate_response(full_prompt, config)
+        policy = self._resolve_hedging_policy(config)
+        if policy is None:
+            if not self._circuit_breaker(provider_name, config).allow_request():
+                raise RuntimeError(f"Circuit open for '{self._route_name(provider_name, config)}'")
+            return await self._call_provider(provider_name, full_prompt, config)
+        
+        fallback_name = policy.fallback_provider or provider_name
+        self._check_provider(fallback_name)
+        fallback_config = self._fallback_config(provider_name, config, policy, fallback_api_key)
+        
+        # Route straight to the fallback while the primary's circuit is open
+        if not self._circuit_breaker(provider_name, config).allow_request():
+            primary_route = self._route_name(provider_name, config)
+            fallback_route = self._route_name(fallback_name, fallback_config)
+            if not self._circuit_breaker(fallback_name, fallback_config).allow_request():
+                raise RuntimeError(f"Circuits open for '{primary_route}' and fallback '{fallback_route}'")
+            
+            logger.warning(f"Circuit open for '{primary_route}', routing to '{fallback_route}'")
+            return await self._call_provider(fallback_name, full_prompt, fallback_config)
+        
+        return await self._hedged_call(
+            policy,
+            (provider_name, config),
+            (fallback_name, fallback_config),
+            full_prompt
+        )
+    
+    def _check_provider(self, provider_name: str) -> None:
+        if provider_name not in self.providers:
+            available = ", ".join(self.providers.keys())
+            raise ValueError(f"Unknown provider '{provider_name}'. Available: {available}")
+    
+    def _resolve_hedging_policy(self, config: Dict[str, Any]) -> Optional[HedgingPolicy]:
+        """Per-request fallbackProvider/fallbackModel settings override the manager's policy"""
+        fallback_provider = config.get("fallbackProvider")
+        fallback_model = config.get("fallbackModel")
+        if not fallback_provider and not fallback_model:
+            return self.hedging_policy
+        
+        base = self.hedging_policy or HedgingPolicy()
+        return HedgingPolicy(
+            fallback_provider=fallback_provider,
+            fallback_model=fallback_model,
+            percentile=base.percentile,
+            min_samples=base.min_samples,
+            default_delay=base.default_delay,
+            min_delay=base.min_delay
+        )
+    
+    def _fallback_config(
+        self,
+        provider_name: str,
+        config: Dict[str, Any],
+        policy: HedgingPolicy,
+        fallback_api_key: Optional[str]
+    ) -> Dict[str, Any]:
+        """Config for the backup request; another provider never gets the primary's model or credentials"""
+        fallback_config = dict(config)
+        
+        if policy.fallback_provider and policy.fallback_provider != provider_name:
+            fallback_config.pop("model", None)
+            fallback_config.pop("apiKey", None)
+            api_key = fallback_api_key or policy.fallback_api_key
+            if api_key:
+                fallback_config["apiKey"] = api_key
+        
+        if policy.fallback_model:
+            fallback_config["model"] = policy.fallback_model
+        
+        return fallback_config
+    
+    def _route_name(self, provider_name: str, config: Dict[str, Any]) -> str:
+        model = config.get("model")
+        return f"{provider_name}/{model}" if model else provider_name
+    
+    def _latency_tracker(self, provider_name: str, config: Dict[str, Any]) -> LatencyTracker:
+        key = (provider_name, config.get("model"))
+        if key not in self.latency_trackers:
+            self.latency_trackers[key] = LatencyTracker()
+        return self.latency_trackers[key]
+    
+    def _circuit_breaker(self, provider_name: str, config: Dict[str, Any]) -> CircuitBreaker:
+        """Breakers are per provider and model, so a fallback model is a separate route"""
+        key = (provider_name, config.get("model"))
+        if key not in self.circuit_breakers:
+            self.circuit_breakers[key] = CircuitBreaker(**self.circuit_breaker_config)
+        return self.circuit_breakers[key]
+    
+    async def _call_provider(self, provider_name: str, prompt: str, config: Dict[str, Any]) -> str:
+        """Call a single provider, recording its latency and outcome"""
+        tracker = self._latency_tracker(provider_name, config)
+        breaker = self._circuit_breaker(provider_name, config)
+        started = time.monotonic()
+        
+        try:
+            response = await self.providers[provider_name].generate_response(prompt, config)
+        except asyncio.CancelledError:
+            # A cancelled hedge loser took at least this long; keep it so slow providers stay visible
+            elapsed = time.monotonic() - started
+            tracker.record(elapsed)
+            breaker.latencies.record(elapsed)
+            breaker.release_trial()
+            raise
+        except Exception as e:
+            # Client errors such as a bad per-request key say nothing about the provider's health
+            if is_provider_fault(e):
+                breaker.record_failure(time.monotonic() - started)
+            else:
+                breaker.release_trial()
+            raise
+        
+        elapsed = time.monotonic() - started
+        tracker.record(elapsed)
+        breaker.record_success(elapsed)
+        return response
+    
+    async def _hedged_call(
+        self,
+        policy: HedgingPolicy,
+        primary: Tuple[str, Dict[str, Any]],
+        fallback: Tuple[str, Dict[str, Any]],
+        prompt: str
+    ) -> str:
+        """Race the primary against a delayed backup request; the first successful response wins"""
+        primary_name, primary_config = primary
+        fallback_name, fallback_config = fallback
+        
+        delay = policy.hedge_delay(self._latency_tracker(primary_name, primary_config))
+        primary_task = asyncio.create_task(self._call_provider(primary_name, prompt, primary_config))
+        pending = {primary_task}
+        last_error: Optional[BaseException] = None
+        
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            for task in done:
+                error = self._task_error(task)
+                if error is None:
+                    return task.result()
+                last_error = error
+            
+            if self._circuit_breaker(fallback_name, fallback_config).allow_request():
+                if last_error is not None:
+                    logger.warning(f"Provider '{primary_name}' failed, falling back to '{fallback_name}'")
+                else:
+                    logger.info(f"Provider '{primary_name}' exceeded {delay:.2f}s, hedging to '{fallback_name}'")
+                pending.add(asyncio.create_task(self._call_provider(fallback_name, prompt, fallback_config)))
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = self._task_error(task)
+                    if error is None:
+                        return task.result()
+                    last_error = error
+            
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+            # Let cancelled losers finish their latency and breaker bookkeeping
+            await asyncio.gather(*pending, return_exceptions=True)
+    
+    @staticmethod
+    def _task_error(task: asyncio.Task) -> Optional[BaseException]:
+        if task.cancelled():
+            return asyncio.CancelledError()
+        return task.exception()
 
 # Global instance
 llm_manager = LLMManager()
\ No newline at end of file
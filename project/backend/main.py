@@ -5,12 +5,14 @@ from typing import List, Dict, Any, Optional
 import json
 import asyncio
 import logging
+import os
+import uuid
+import zlib
 from datetime import datetime
 
 # Mock implementations - replace with actual integrations
 import fitz  # PyMuPDF for PDF processing
 import chromadb
-from chromadb.config import Settings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,10 +30,13 @@ app.add_middleware(
 )
 
 # Initialize ChromaDB
-chroma_client = chromadb.Client(Settings(
-    chroma_db_impl="duckdb+parquet",
-    persist_directory="./chroma_db"
-))
+chroma_client = chromadb.PersistentClient(path=os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db"))
+
+# Documents share a fixed number of collections; per-document retrieval uses metadata filters
+COLLECTION_SHARD_COUNT = 8
+SHARD_COLLECTION_PREFIX = "documents_shard_"
+LEGACY_COLLECTION_PREFIX = "doc_"
+MIGRATION_BATCH_SIZE = 500
 
 # Data models
 class WorkflowNode(BaseModel):
@@ -95,9 +100,10 @@ async def upload_pdf(
         # Create embeddings (mock implementation)
         embeddings = await create_embeddings(text_content, embedding_provider, api_key)
         
-        # Store in ChromaDB
-        collection_name = f"doc_{file.filename}_{datetime.now().timestamp()}"
-        collection = chroma_client.create_collection(name=collection_name)
+        # Store in the document's ChromaDB shard
+        doc_id = f"doc_{uuid.uuid4().hex}"
+        collection_name = get_shard_collection_name(doc_id)
+        collection = chroma_client.get_or_create_collection(name=collection_name)
         
         # Split text into chunks (simplified)
         chunks = split_text_into_chunks(text_content)
@@ -105,12 +111,14 @@ async def upload_pdf(
         # Add to collection
         collection.add(
             documents=chunks,
-            metadatas=[{"source": file.filename, "chunk_id": i} for i in range(len(chunks))],
-            ids=[f"chunk_{i}" for i in range(len(chunks))]
+            metadatas=[
+                {"source": file.filename, "document_id": doc_id, "chunk_id": i}
+                for i in range(len(chunks))
+            ],
+            ids=[f"{doc_id}_chunk_{i}" for i in range(len(chunks))]
         )
         
         # Store document metadata
-        doc_id = f"doc_{datetime.now().timestamp()}"
         uploaded_documents[doc_id] = {
             "filename": file.filename,
             "collection_name": collection_name,
@@ -186,6 +194,20 @@ async def list_documents():
     """List all uploaded documents"""
     return {"documents": uploaded_documents}
 
+@app.post("/migrate_collections")
+async def migrate_collections():
+    """Move legacy per-upload collections into the shared sharded collections"""
+    try:
+        # Chroma work runs off the event loop; registry changes are applied back on it
+        registered = {doc_info["collection_name"]: doc_id for doc_id, doc_info in uploaded_documents.items()}
+        migrated = await asyncio.to_thread(migrate_legacy_collections, registered)
+        register_migrated_documents(migrated)
+        return {"success": True, "migrated": migrated}
+        
+    except Exception as e:
+        logger.error(f"Error migrating collections: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error migrating collections: {str(e)}")
+
 # Helper functions
 def validate_workflow(nodes: List[WorkflowNode], edges: List[WorkflowEdge]) -> Dict[str, Any]:
     """Validate workflow structure"""
@@ -251,31 +273,14 @@ async def retrieve_context(query: str, kb_node: WorkflowNode) -> str:
     """Retrieve relevant context from knowledge base"""
     try:
         config = kb_node.data.get("config", {})
-        filename = config.get("fileName")
+        doc_ids = resolve_document_ids(config)
         
-        if not filename:
+        if not doc_ids:
+            if config.get("fileName") or config.get("documentId") or config.get("documentIds"):
+                logger.warning(f"No uploaded document found for knowledge base config: {config}")
             return ""
         
-        # Find the document collection
-        doc_collection = None
-        for doc_id, doc_info in uploaded_documents.items():
-            if doc_info["filename"] == filename:
-                doc_collection = doc_info["collection_name"]
-                break
-        
-        if not doc_collection:
-            logger.warning(f"No collection found for document: {filename}")
-            return ""
-        
-        # Query the collection
-        collection = chroma_client.get_collection(name=doc_collection)
-        results = collection.query(
-            query_texts=[query],
-            n_results=3
-        )
-        
-        # Combine retrieved documents
-        context = "\n\n".join(results["documents"][0]) if results["documents"] else ""
+        context = "\n\n".join(query_documents(query, doc_ids))
         
         logger.info(f"Retrieved context length: {len(context)}")
         return context
@@ -284,6 +289,126 @@ async def retrieve_context(query: str, kb_node: WorkflowNode) -> str:
         logger.error(f"Error retrieving context: {str(e)}")
         return ""
 
+def resolve_document_ids(config: Dict[str, Any]) -> List[str]:
+    """Documents to search: explicit documentId(s), else the latest upload named fileName"""
+    doc_ids = config.get("documentIds") or ([config["documentId"]] if config.get("documentId") else [])
+    if doc_ids:
+        return [doc_id for doc_id in doc_ids if doc_id in uploaded_documents]
+    
+    filename = config.get("fileName")
+    if not filename:
+        return []
+    
+    matches = [doc_id for doc_id, doc_info in uploaded_documents.items() if doc_info["filename"] == filename]
+    return matches[-1:]
+
+def query_documents(query: str, doc_ids: List[str], n_results: int = 3) -> List[str]:
+    """Search the given documents with at most one query per shard, returning the closest chunks"""
+    shard_documents: Dict[str, List[str]] = {}
+    for doc_id in doc_ids:
+        shard_documents.setdefault(uploaded_documents[doc_id]["collection_name"], []).append(doc_id)
+    
+    matches = []
+    for collection_name, shard_doc_ids in shard_documents.items():
+        collection = chroma_client.get_collection(name=collection_name)
+        if len(shard_doc_ids) == 1:
+            where = {"document_id": shard_doc_ids[0]}
+        else:
+            where = {"document_id": {"$in": shard_doc_ids}}
+        
+        results = collection.query(
+            query_texts=[query],
+            n_results=n_results,
+            where=where
+        )
+        
+        if results["documents"]:
+            matches.extend(zip(results["distances"][0], results["documents"][0]))
+    
+    # Closest chunks across shards, skipping repeated text
+    matches.sort(key=lambda match: match[0])
+    documents = []
+    for _, document in matches:
+        if document not in documents:
+            documents.append(document)
+        if len(documents) == n_results:
+            break
+    
+    return documents
+
+def get_shard_collection_name(doc_id: str) -> str:
+    """Map a document id to its shared collection"""
+    shard = zlib.crc32(doc_id.encode("utf-8")) % COLLECTION_SHARD_COUNT
+    return f"{SHARD_COLLECTION_PREFIX}{shard}"
+
+def migrate_legacy_collections(registered: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Copy each legacy doc_* collection into its shard in batches, then delete it
+
+    Only touches Chroma so it can run in a worker thread. `registered` maps legacy
+    collection names to known document ids; apply the result with
+    register_migrated_documents.
+    """
+    migrated = []
+    
+    for legacy in chroma_client.list_collections():
+        if not legacy.name.startswith(LEGACY_COLLECTION_PREFIX):
+            continue
+        
+        # Reuse the registered document id if this upload is still known
+        doc_id = registered.get(legacy.name, legacy.name)
+        collection_name = get_shard_collection_name(doc_id)
+        shard = chroma_client.get_or_create_collection(name=collection_name)
+        
+        chunk_count = 0
+        source = None
+        while True:
+            records = legacy.get(
+                include=["documents", "metadatas", "embeddings"],
+                limit=MIGRATION_BATCH_SIZE,
+                offset=chunk_count
+            )
+            if not records["ids"]:
+                break
+            
+            metadatas = [dict(metadata or {}, document_id=doc_id) for metadata in records["metadatas"]]
+            source = source or metadatas[0].get("source")
+            shard.upsert(
+                ids=[f"{doc_id}_{chunk_id}" for chunk_id in records["ids"]],
+                documents=records["documents"],
+                metadatas=metadatas,
+                embeddings=records["embeddings"]
+            )
+            chunk_count += len(records["ids"])
+        
+        chroma_client.delete_collection(name=legacy.name)
+        migrated.append({
+            "collection": legacy.name,
+            "document_id": doc_id,
+            "collection_name": collection_name,
+            "filename": source or legacy.name,
+            "chunk_count": chunk_count
+        })
+        logger.info(f"Migrated collection {legacy.name} to {collection_name}")
+    
+    return migrated
+
+def register_migrated_documents(migrated: List[Dict[str, Any]]) -> None:
+    """Point the document registry at the shards returned by migrate_legacy_collections"""
+    for entry in migrated:
+        doc_id = entry["document_id"]
+        if doc_id in uploaded_documents:
+            uploaded_documents[doc_id]["collection_name"] = entry["collection_name"]
+        elif entry["chunk_count"]:
+            # Chunks overlap, so the original text length can't be recovered
+            uploaded_documents[doc_id] = {
+                "filename": entry["filename"],
+                "collection_name": entry["collection_name"],
+                "text_length": None,
+                "chunk_count": entry["chunk_count"],
+                "embedding_provider": "unknown",
+                "upload_time": datetime.now().isoformat()
+            }
+
 async def call_llm(query: str, context: str, llm_node: WorkflowNode) -> str:
     """Call the specified LLM provider"""
     try:
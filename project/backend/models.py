@@ -36,7 +36,7 @@ class WorkflowResponse(BaseModel):
 class DocumentInfo(BaseModel):
     filename: str
     collection_name: str
-    text_length: int
+    text_length: Optional[int] = None
     chunk_count: int
     embedding_provider: str
     upload_time: str
@@ -0,0 +1,228 @@
+import asyncio
+import unittest
+
+import httpx
+
+from llm_providers import (
+    CircuitBreaker,
+    HedgingPolicy,
+    LLMManager,
+    LLMProvider,
+    ProviderUnavailableError,
+    is_provider_fault
+)
+
+class StubProvider(LLMProvider):
+    """Replies with a fixed text after a delay, or raises"""
+    
+    def __init__(self, reply: str, delay: float = 0.0, error: Exception = None):
+        self.reply = reply
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.configs = []
+    
+    async def generate_response(self, prompt, config):
+        self.calls += 1
+        self.configs.append(config)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return self.reply
+
+def make_manager(primary: StubProvider, fallback: StubProvider, **breaker_config) -> LLMManager:
+    manager = LLMManager(
+        HedgingPolicy(fallback_provider="groq", default_delay=0.05),
+        circuit_breaker_config=breaker_config or None
+    )
+    manager.providers["openai"] = primary
+    manager.providers["groq"] = fallback
+    return manager
+
+class HedgedCallTest(unittest.IsolatedAsyncioTestCase):
+    
+    async def test_primary_wins(self):
+        primary, fallback = StubProvider("primary"), StubProvider("fallback")
+        manager = make_manager(primary, fallback)
+        
+        self.assertEqual(await manager.generate_response("openai", "hi", {}), "primary")
+        self.assertEqual(fallback.calls, 0)
+    
+    async def test_hedge_wins_and_primary_is_cancelled(self):
+        primary, fallback = StubProvider("primary", delay=5), StubProvider("fallback")
+        manager = make_manager(primary, fallback)
+        
+        self.assertEqual(await manager.generate_response("openai", "hi", {}), "fallback")
+        self.assertEqual(primary.cancelled, 1)
+        # The cancelled loser's elapsed time is still recorded
+        self.assertEqual(len(manager.latency_trackers[("openai", None)].samples), 1)
+    
+    async def test_primary_fails_early(self):
+        primary = StubProvider("primary", error=ProviderUnavailableError("boom"))
+        fallback = StubProvider("fallback")
+        manager = make_manager(primary, fallback)
+        
+        self.assertEqual(await manager.generate_response("openai", "hi", {}), "fallback")
+        self.assertEqual(manager.circuit_breakers[("openai", None)].outcomes[-1], False)
+    
+    async def test_both_fail_raises_last_error(self):
+        primary = StubProvider("primary", error=ProviderUnavailableError("primary"))
+        fallback = StubProvider("fallback", error=ProviderUnavailableError("fallback"))
+        manager = make_manager(primary, fallback)
+        
+        with self.assertRaises(ProviderUnavailableError):
+            await manager.generate_response("openai", "hi", {})
+    
+    async def test_cross_provider_fallback_gets_its_own_model_and_key(self):
+        primary, fallback = StubProvider("primary", delay=5), StubProvider("fallback")
+        manager = make_manager(primary, fallback)
+        config = {
+            "model": "gpt-4o",
+            "apiKey": "sk-openai",
+            "fallbackProvider": "groq",
+            "fallbackApiKey": "gsk-groq",
+            "temperature": 0.2
+        }
+        
+        self.assertEqual(await manager.generate_response("openai", "hi", config), "fallback")
+        primary_config, fallback_config = primary.configs[0], fallback.configs[0]
+        self.assertEqual(primary_config["apiKey"], "sk-openai")
+        self.assertNotIn("fallbackApiKey", primary_config)
+        self.assertNotIn("model", fallback_config)
+        self.assertEqual(fallback_config["apiKey"], "gsk-groq")
+        self.assertEqual(fallback_config["temperature"], 0.2)
+        self.assertIn(("groq", None), manager.circuit_breakers)
+        self.assertNotIn(("groq", "gpt-4o"), manager.circuit_breakers)
+    
+    async def test_cross_provider_fallback_without_key_drops_primary_key(self):
+        primary, fallback = StubProvider("primary", delay=5), StubProvider("fallback")
+        manager = make_manager(primary, fallback)
+        config = {"model": "gpt-4o", "apiKey": "sk-openai", "fallbackProvider": "groq", "fallbackModel": "mixtral"}
+        
+        await manager.generate_response("openai", "hi", config)
+        self.assertNotIn("apiKey", fallback.configs[0])
+        self.assertEqual(fallback.configs[0]["model"], "mixtral")
+    
+    async def test_open_circuit_without_hedging_fails_fast(self):
+        primary = StubProvider("primary")
+        manager = LLMManager(circuit_breaker_config={"cooldown": 60})
+        manager.providers["openai"] = primary
+        manager._circuit_breaker("openai", {"model": "gpt-4o"})._trip()
+        
+        with self.assertRaises(RuntimeError):
+            await manager.generate_response("openai", "hi", {"model": "gpt-4o"})
+        self.assertEqual(primary.calls, 0)
+    
+    async def test_client_errors_do_not_trip_the_breaker(self):
+        primary = StubProvider("primary", error=ValueError("invalid api key"))
+        manager = LLMManager(circuit_breaker_config={"min_requests": 2})
+        manager.providers["openai"] = primary
+        
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                await manager.generate_response("openai", "hi", {})
+        breaker = manager.circuit_breakers[("openai", None)]
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(len(breaker.outcomes), 0)
+    
+    async def test_open_circuit_routes_to_fallback_model(self):
+        primary = StubProvider("primary")
+        manager = LLMManager(circuit_breaker_config={"cooldown": 60})
+        manager.providers["openai"] = primary
+        manager._circuit_breaker("openai", {"model": "gpt-4o"})._trip()
+        
+        config = {"model": "gpt-4o", "fallbackModel": "gpt-4o-mini"}
+        self.assertEqual(await manager.generate_response("openai", "hi", config), "primary")
+        self.assertEqual(manager.circuit_breakers[("openai", "gpt-4o-mini")].outcomes[-1], True)
+        self.assertEqual(manager.circuit_breakers[("openai", "gpt-4o")].state, CircuitBreaker.OPEN)
+    
+    async def test_both_circuits_open_fails_fast(self):
+        primary, fallback = StubProvider("primary"), StubProvider("fallback")
+        manager = make_manager(primary, fallback, cooldown=60)
+        manager._circuit_breaker("openai", {})._trip()
+        manager._circuit_breaker("groq", {})._trip()
+        
+        with self.assertRaises(RuntimeError):
+            await manager.generate_response("openai", "hi", {})
+        self.assertEqual(primary.calls + fallback.calls, 0)
+
+class ProviderFaultTest(unittest.TestCase):
+    
+    def status_error(self, status: int) -> httpx.HTTPStatusError:
+        request = httpx.Request("POST", "https://api.example.com")
+        response = httpx.Response(status, request=request)
+        return httpx.HTTPStatusError("error", request=request, response=response)
+    
+    def test_transport_and_server_errors_are_faults(self):
+        self.assertTrue(is_provider_fault(httpx.ConnectError("down")))
+        self.assertTrue(is_provider_fault(httpx.ReadTimeout("slow")))
+        self.assertTrue(is_provider_fault(asyncio.TimeoutError()))
+        self.assertTrue(is_provider_fault(self.status_error(503)))
+        self.assertTrue(is_provider_fault(self.status_error(429)))
+    
+    def test_client_errors_are_not_faults(self):
+        self.assertFalse(is_provider_fault(self.status_error(401)))
+        self.assertFalse(is_provider_fault(self.status_error(400)))
+        self.assertFalse(is_provider_fault(ValueError("bad input")))
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+    
+    def test_trips_on_error_rate(self):
+        breaker = CircuitBreaker(min_requests=3, error_rate_threshold=0.5)
+        breaker.record_success(0.1)
+        breaker.record_failure()
+        breaker.record_failure()
+        
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+    
+    def test_trips_on_latency_when_configured(self):
+        breaker = CircuitBreaker(min_requests=3, latency_threshold=1.0)
+        for _ in range(3):
+            breaker.record_success(2.0)
+        
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+    
+    def test_open_half_open_closed(self):
+        breaker = CircuitBreaker(cooldown=0)
+        breaker._trip()
+        
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow_request())
+        
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+    
+    def test_half_open_failure_reopens(self):
+        breaker = CircuitBreaker(cooldown=60)
+        breaker.state = CircuitBreaker.HALF_OPEN
+        
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+    
+    async def test_half_open_trial_cancelled_by_hedge_is_released(self):
+        primary, fallback = StubProvider("primary", delay=5), StubProvider("fallback")
+        manager = make_manager(primary, fallback, cooldown=0)
+        breaker = manager._circuit_breaker("openai", {})
+        breaker._trip()
+        
+        self.assertEqual(await manager.generate_response("openai", "hi", {}), "fallback")
+        self.assertEqual(primary.cancelled, 1)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        
+        # Once the primary recovers, the next trial goes through and closes the circuit
+        primary.delay = 0
+        self.assertEqual(await manager.generate_response("openai", "hi", {}), "primary")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+if __name__ == "__main__":
+    unittest.main()
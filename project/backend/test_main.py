@@ -0,0 +1,189 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# Keep the module-level persistent client out of the working tree
+os.environ.setdefault("CHROMA_PERSIST_DIRECTORY", tempfile.mkdtemp())
+
+import chromadb
+import fitz
+from fastapi.testclient import TestClient
+
+import main
+
+class LetterEmbeddingFunction:
+    """Deterministic offline embeddings: letter counts per text"""
+    
+    def __call__(self, input):
+        return [[float(text.lower().count(letter)) for letter in "abcdefghijklmnopqrstuvwxyz"] for text in input]
+
+class InMemoryChroma:
+    """Ephemeral Chroma client whose collections all use LetterEmbeddingFunction"""
+    
+    def __init__(self):
+        self.client = chromadb.EphemeralClient()
+        self.embedding_function = LetterEmbeddingFunction()
+        for collection in self.client.list_collections():
+            self.client.delete_collection(name=collection.name)
+    
+    def create_collection(self, name):
+        return self.client.create_collection(name=name, embedding_function=self.embedding_function)
+    
+    def get_collection(self, name):
+        return self.client.get_collection(name=name, embedding_function=self.embedding_function)
+    
+    def get_or_create_collection(self, name):
+        return self.client.get_or_create_collection(name=name, embedding_function=self.embedding_function)
+    
+    def list_collections(self):
+        return [self.get_collection(collection.name) for collection in self.client.list_collections()]
+    
+    def delete_collection(self, name):
+        self.client.delete_collection(name=name)
+
+def make_pdf(text: str) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), text)
+    content = doc.tobytes()
+    doc.close()
+    return content
+
+def kb_node(**config) -> main.WorkflowNode:
+    return main.WorkflowNode(id="kb", type="knowledgeBase", position={"x": 0, "y": 0}, data={"config": config})
+
+class ChromaTestCase(unittest.IsolatedAsyncioTestCase):
+    
+    def setUp(self):
+        self.chroma = InMemoryChroma()
+        patches = [
+            mock.patch.object(main, "chroma_client", self.chroma),
+            mock.patch.object(main, "uploaded_documents", {}),
+            # A single shard so every document shares one collection
+            mock.patch.object(main, "COLLECTION_SHARD_COUNT", 1),
+            mock.patch.object(main, "create_embeddings", mock.AsyncMock(return_value=[]))
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = TestClient(main.app)
+    
+    def upload(self, filename: str, text: str) -> str:
+        response = self.client.post(
+            "/upload_pdf",
+            files={"file": (filename, make_pdf(text), "application/pdf")},
+            data={"embedding_provider": "openai", "api_key": "key"}
+        )
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()["document_id"]
+
+class ShardedStorageTest(ChromaTestCase):
+    
+    def test_shard_collection_name_is_stable(self):
+        with mock.patch.object(main, "COLLECTION_SHARD_COUNT", 8):
+            name = main.get_shard_collection_name("doc_abc")
+            self.assertEqual(name, main.get_shard_collection_name("doc_abc"))
+            self.assertIn(name, {f"{main.SHARD_COLLECTION_PREFIX}{i}" for i in range(8)})
+    
+    def test_upload_stores_chunks_with_document_metadata(self):
+        first = self.upload("a.pdf", "apples and avocados")
+        second = self.upload("a.pdf", "apples and avocados")
+        
+        self.assertNotEqual(first, second)
+        shard = self.chroma.get_collection(main.get_shard_collection_name(first))
+        records = shard.get(where={"document_id": first})
+        self.assertEqual(len(records["ids"]), 1)
+        self.assertTrue(records["ids"][0].startswith(f"{first}_chunk_"))
+        self.assertEqual(records["metadatas"][0]["source"], "a.pdf")
+        self.assertEqual(len(self.chroma.list_collections()), 1)
+    
+    async def test_retrieve_context_filters_by_document_id(self):
+        apples = self.upload("apples.pdf", "apples apples apples")
+        self.upload("zebras.pdf", "zebras zebras zebras")
+        
+        context = await main.retrieve_context("zebras", kb_node(documentId=apples))
+        self.assertIn("apples", context)
+        self.assertNotIn("zebras", context)
+    
+    async def test_retrieve_context_searches_several_documents(self):
+        apples = self.upload("apples.pdf", "apples apples apples")
+        zebras = self.upload("zebras.pdf", "zebras zebras zebras")
+        self.upload("kiwis.pdf", "kiwis kiwis kiwis")
+        
+        context = await main.retrieve_context("zebras", kb_node(documentIds=[apples, zebras]))
+        self.assertIn("apples", context)
+        self.assertIn("zebras", context)
+        self.assertNotIn("kiwis", context)
+    
+    async def test_retrieve_context_by_filename_uses_latest_upload(self):
+        self.upload("notes.pdf", "old draft")
+        self.upload("notes.pdf", "final version")
+        
+        context = await main.retrieve_context("version", kb_node(fileName="notes.pdf"))
+        self.assertEqual(context, "final version")
+
+class MigrationTest(ChromaTestCase):
+    
+    def add_legacy_collection(self, name: str, chunks):
+        collection = self.chroma.create_collection(name)
+        collection.add(
+            documents=chunks,
+            metadatas=[{"source": "legacy.pdf", "chunk_id": i} for i in range(len(chunks))],
+            ids=[f"chunk_{i}" for i in range(len(chunks))]
+        )
+    
+    def test_migrates_registered_and_unregistered_collections(self):
+        self.add_legacy_collection("doc_known.pdf_1", ["one", "two", "three"])
+        self.add_legacy_collection("doc_orphan.pdf_2", ["four", "five"])
+        main.uploaded_documents["doc_known"] = {
+            "filename": "known.pdf",
+            "collection_name": "doc_known.pdf_1",
+            "text_length": 11,
+            "chunk_count": 3,
+            "embedding_provider": "openai",
+            "upload_time": "2024-01-01T00:00:00"
+        }
+        
+        # Batches smaller than the collections exercise offset paging
+        with mock.patch.object(main, "MIGRATION_BATCH_SIZE", 2):
+            response = self.client.post("/migrate_collections")
+        
+        self.assertEqual(response.status_code, 200, response.text)
+        migrated = {entry["collection"]: entry for entry in response.json()["migrated"]}
+        self.assertEqual(migrated["doc_known.pdf_1"]["chunk_count"], 3)
+        self.assertEqual(migrated["doc_orphan.pdf_2"]["chunk_count"], 2)
+        self.assertEqual([c.name for c in self.chroma.list_collections()], [main.get_shard_collection_name("x")])
+        
+        shard = self.chroma.get_collection(main.get_shard_collection_name("doc_known"))
+        known = shard.get(where={"document_id": "doc_known"})
+        self.assertEqual(sorted(known["ids"]), ["doc_known_chunk_0", "doc_known_chunk_1", "doc_known_chunk_2"])
+        self.assertEqual(sorted(known["documents"]), ["one", "three", "two"])
+        self.assertEqual(len(shard.get(where={"document_id": "doc_orphan.pdf_2"})["ids"]), 2)
+        
+        self.assertEqual(main.uploaded_documents["doc_known"]["collection_name"], shard.name)
+        self.assertEqual(main.uploaded_documents["doc_known"]["text_length"], 11)
+        orphan = main.uploaded_documents["doc_orphan.pdf_2"]
+        self.assertEqual(orphan["filename"], "legacy.pdf")
+        self.assertIsNone(orphan["text_length"])
+        self.assertEqual(orphan["chunk_count"], 2)
+    
+    async def test_migrated_document_is_retrievable(self):
+        self.add_legacy_collection("doc_legacy.pdf_1", ["apples apples", "zebras zebras"])
+        self.upload("kiwis.pdf", "kiwis kiwis kiwis")
+        
+        main.register_migrated_documents(main.migrate_legacy_collections({}))
+        
+        context = await main.retrieve_context("kiwis", kb_node(fileName="legacy.pdf"))
+        self.assertIn("apples", context)
+        self.assertNotIn("kiwis", context)
+    
+    def test_second_run_is_a_no_op(self):
+        self.add_legacy_collection("doc_legacy.pdf_1", ["one"])
+        
+        self.assertEqual(len(self.client.post("/migrate_collections").json()["migrated"]), 1)
+        self.assertEqual(self.client.post("/migrate_collections").json()["migrated"], [])
+        self.assertEqual(len(main.uploaded_documents), 1)
+
+if __name__ == "__main__":
+    unittest.main()